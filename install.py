@@ -10,8 +10,20 @@ import os
 import sys
 import subprocess
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+# orjson es opcional (puede no estar instalado todavía al ejecutar el instalador)
+try:
+    import orjson
+    
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode('utf-8')
+except ImportError:
+    def _dumps(obj) -> str:
+        return json.dumps(obj, indent=2)
+
 # FIX: Forzar la codificación UTF-8 para la salida en consolas Windows (soluciona UnicodeEncodeError)
 if sys.platform == "win32":
     try:
@@ -22,6 +34,14 @@ if sys.platform == "win32":
         # Si falla (ej. en un entorno sin buffer), ignorar y usar la configuración por defecto
         pass
 
+# Los pasos de instalación se ejecutan en paralelo: serializar la salida por línea
+_print_lock = threading.Lock()
+
+def safe_print(*args, **kwargs):
+    """print() protegido con un lock para evitar salida entrelazada"""
+    with _print_lock:
+        print(*args, **kwargs)
+
 def check_python_version():
     """Verifica la versión de Python"""
     if sys.version_info < (3, 8):
@@ -32,23 +52,24 @@ def check_python_version():
 
 def install_dependencies():
     """Instala las dependencias necesarias"""
-    print("\n📦 Instalando dependencias...")
+    safe_print("\n📦 Instalando dependencias...")
     
     # Intentar instalar dependencias principales
     try:
-        subprocess.run([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"], 
-                      check=True, capture_output=True)
-        print("✅ Dependencias instaladas correctamente")
+        subprocess.run([sys.executable, "-m", "pip", "install", "-r", "requirements.txt",
+                        "--disable-pip-version-check", "--no-input"], 
+                      check=True, capture_output=True, text=True)
+        safe_print("✅ Dependencias instaladas correctamente")
     except subprocess.CalledProcessError as e:
-        print("❌ Error instalando dependencias:")
-        print(e.stderr.decode())
+        safe_print("❌ Error instalando dependencias:")
+        safe_print(e.stderr)
         return False
     
     return True
 
 def setup_directories():
     """Crea los directorios necesarios"""
-    print("\n📁 Configurando directorios...")
+    safe_print("\n📁 Configurando directorios...")
     
     directories = [
         "agent_tools",
@@ -58,14 +79,14 @@ def setup_directories():
     
     for directory in directories:
         Path(directory).mkdir(exist_ok=True)
-        print(f"✅ Directorio creado: {directory}")
+        safe_print(f"✅ Directorio creado: {directory}")
 
 def create_sample_keys_file():
     """Crea un archivo de ejemplo para las API keys"""
     keys_file = Path("keys.json")
     
     if not keys_file.exists():
-        print("\n🔑 Creando archivo de ejemplo para API keys...")
+        safe_print("\n🔑 Creando archivo de ejemplo para API keys...")
         
         sample_keys = {
             "gemini_api_keys": [
@@ -74,48 +95,40 @@ def create_sample_keys_file():
             "notas": "Obtén tu API key de Gemini en: https://makersuite.google.com/app/apikey"
         }
         
-        with open(keys_file, 'w') as f:
-            json.dump(sample_keys, f, indent=2)
+        with open(keys_file, 'w', encoding='utf-8') as f:
+            f.write(_dumps(sample_keys))
         
-        print("✅ Archivo keys.json creado")
-        print("⚠️  Recuerda agregar tu API key real antes de usar Gemini")
+        safe_print("✅ Archivo keys.json creado")
+        safe_print("⚠️  Recuerda agregar tu API key real antes de usar Gemini")
     else:
-        print("✅ Archivo keys.json ya existe")
+        safe_print("✅ Archivo keys.json ya existe")
 
 def check_ollama():
     """Verifica si Ollama está instalado y disponible"""
-    print("\n🦙 Verificando Ollama...")
+    safe_print("\n🦙 Verificando Ollama...")
     
+    # `ollama list` ya implica que el binario existe: una sola llamada basta
     try:
-        result = subprocess.run(["ollama", "--version"], 
-                              capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"✅ Ollama encontrado: {result.stdout.strip()}")
-            
-            # Verificar modelos disponibles
-            try:
-                models_result = subprocess.run(["ollama", "list"], 
-                                             capture_output=True, text=True)
-                if models_result.returncode == 0:
-                    print("📋 Modelos disponibles:")
-                    print(models_result.stdout)
-                else:
-                    print("⚠️ No se pudieron listar los modelos")
-            except:
-                print("⚠️ Error verificando modelos")
-                
+        models_result = subprocess.run(["ollama", "list"], 
+                                     capture_output=True, text=True, timeout=5)
+        if models_result.returncode == 0:
+            safe_print("✅ Ollama encontrado")
+            safe_print("📋 Modelos disponibles:")
+            safe_print(models_result.stdout)
         else:
-            print("❌ Ollama no está instalado o no está en el PATH")
-            print("   Instala Ollama desde: https://ollama.com")
+            safe_print("⚠️ Ollama está instalado pero no se pudieron listar los modelos")
+            safe_print("   Asegúrate de que el servicio de Ollama esté ejecutándose")
             
     except FileNotFoundError:
-        print("❌ Ollama no está instalado")
-        print("   Instala Ollama desde: https://ollama.com")
-        print("   O ejecuta: curl -fsSL https://ollama.com/install.sh | sh")
+        safe_print("❌ Ollama no está instalado")
+        safe_print("   Instala Ollama desde: https://ollama.com")
+        safe_print("   O ejecuta: curl -fsSL https://ollama.com/install.sh | sh")
+    except subprocess.TimeoutExpired:
+        safe_print("⚠️ Ollama no respondió a tiempo")
 
 def create_startup_script():
     """Crea un script de inicio para facilitar el uso"""
-    print("\n🚀 Creando script de inicio...")
+    safe_print("\n🚀 Creando script de inicio...")
     
     # Script para Unix/Linux/Mac
     startup_script_unix = """#!/bin/bash
@@ -138,7 +151,7 @@ python main_mejorado.py %*
     with open("start.bat", "w") as f:
         f.write(startup_script_windows)
     
-    print("✅ Scripts de inicio creados: start.sh y start.bat")
+    safe_print("✅ Scripts de inicio creados: start.sh y start.bat")
 
 def main():
     """Función principal del instalador"""
@@ -148,17 +161,33 @@ def main():
     # Verificaciones
     check_python_version()
     
-    # Instalación
-    if not install_dependencies():
+    # Instalación: pip en paralelo con los pasos locales independientes
+    tasks = {
+        "dependencias": install_dependencies,
+        "directorios": setup_directories,
+        "keys.json": create_sample_keys_file,
+        "ollama": check_ollama,
+        "scripts de inicio": create_startup_script,
+    }
+    
+    dependencies_ok = True
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = {executor.submit(func): name for name, func in tasks.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                safe_print(f"❌ Error en el paso '{name}': {e}")
+                result = False
+            if name == "dependencias":
+                dependencies_ok = result is not False
+    
+    if not dependencies_ok:
         print("\n❌ Falló la instalación de dependencias")
         print("Por favor, instala manualmente con: pip install -r requirements.txt")
         return
     
-    setup_directories()
-    create_sample_keys_file()
-    check_ollama()
-    create_startup_script()
-    
     print("\n" + "=" * 50)
     print("🎉 Instalación completada!")
     print("\nPróximos pasos:")
@@ -17,39 +17,72 @@ Características principales:
 # Standard library imports
 import os
 import sys
+import string
 import json
-import re
 import subprocess
 import uuid
+import importlib
 import importlib.util
 import inspect
 import datetime
 import argparse
+import ast
+import asyncio
+import contextlib
 import logging
+import logging.handlers
+import queue
+import atexit
+import functools
+import hashlib
+import pickle
+import shelve
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Callable, Union
+from types import ModuleType
+from urllib.parse import urlsplit
+from typing import Deque, Dict, Iterator, List, Mapping, Optional, Any, Callable, Tuple, Union
 from dataclasses import dataclass, field
 from enum import Enum
 
 # Third-party imports
-import chromadb
 from rich.console import Console
 from rich.panel import Panel
-from rich.syntax import Syntax
-from rich.markdown import Markdown
 from rich.prompt import Prompt
+from rich.style import Style
 from rich.logging import RichHandler
-import ollama
 
+
+class _LazyModule(ModuleType):
+    """Proxy de módulo que difiere la importación hasta el primer acceso"""
+    
+    def __getattr__(self, attr: str) -> Any:
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def _lazy(name: str) -> ModuleType:
+    """Devuelve un módulo que solo se importa cuando se usa por primera vez"""
+    return _LazyModule(name)
+
+
+# ChromaDB y Ollama son pesados de importar: se cargan bajo demanda.
+# Google AI se importa en ModelManager._setup_gemini.
+chromadb = _lazy("chromadb")
+ollama = _lazy("ollama")
+np = _lazy("numpy")
+
+# orjson es opcional: parseo JSON más rápido si está instalado
 try:
-    import google.generativeai as genai
-    import google.generativeai.types as genai_types
-    from google.generativeai.protos import ToolConfig, FunctionCallingConfig, FunctionDeclaration, Schema, Type
-    from google.api_core import exceptions
-    GOOGLE_AI_AVAILABLE = True
+    import orjson
+    _loads = orjson.loads
 except ImportError:
-    GOOGLE_AI_AVAILABLE = False
-    console.print("[yellow]Advertencia: Google AI no está disponible. Solo se usará Ollama.[/yellow]")
+    _loads = json.loads
 
 # ============================================================================
 # CONFIGURACIÓN Y CONSTANTES
@@ -70,9 +103,36 @@ class Config:
     API_KEYS_FILE: str = "keys.json"
     
     # Modelos
+    OLLAMA_HOST: str = field(
+        default_factory=lambda: os.getenv("OLLAMA_HOST", "http://localhost:11434")
+    )
     OLLAMA_EMBEDDING_MODEL: str = "nomic-embed-text"
+    EMBEDDING_CACHE_FILE: str = "embed_cache"
+    OLLAMA_LIST_CACHE_FILE: str = "ollama_list.pkl"
+    EMBEDDING_CACHE_SIZE: int = 4096
+    MEMORY_BATCH_SIZE: int = 32
+    # Índice HNSW ajustado para unos pocos miles de recuerdos
+    MEMORY_HNSW_SETTINGS: Dict[str, Any] = field(default_factory=lambda: {
+        "hnsw:space": "cosine",
+        "hnsw:M": 8,
+        "hnsw:construction_ef": 64,
+        "hnsw:search_ef": 32
+    })
+    MEMORY_FLUSH_INTERVAL: float = 5.0
+    # Caché semántica de consultas a memoria
+    MEMORY_QUERY_CACHE_SIZE: int = 256
+    MEMORY_QUERY_CACHE_SIMILARITY: float = 0.95
+    MEMORY_QUERY_CACHE_LSH_BITS: int = 8
+    # Espera máxima (segundos) por los recuerdos antes de continuar sin ellos;
+    # la primera recuperación de la sesión no tiene límite (Ollama carga el modelo)
+    MEMORY_TIMEOUT: float = 10.0
     MAX_STEPS_PER_TASK: int = 10
+    HISTORY_MAX_TURNS: int = 40
+    # Longitud máxima de un resultado de herramienta guardado en el historial
+    MAX_TOOL_RESULT_CHARS: int = 4000
     STEP_INCREMENT: int = 10
+    # Resultados de herramientas más largos se vuelcan sin Panel
+    RESULT_STREAM_THRESHOLD: int = 8000
     
     # Modelos Gemini preferidos
     PREFERRED_GEMINI_MODELS: List[str] = field(default_factory=lambda: [
@@ -83,28 +143,185 @@ class Config:
         "models/gemini-1.5-pro",
         "models/gemini-1.5-flash"
     ])
+    GEMINI_SAFETY_SETTINGS: Dict[str, str] = field(default_factory=lambda: {
+        "HARM_CATEGORY_HARASSMENT": "block_none",
+        "HARM_CATEGORY_DANGEROUS_CONTENT": "block_none"
+    })
 
 # Instancia global de configuración
 CONFIG = Config()
 
+def _skip_whitespace(text: str, start: int) -> int:
+    """Devuelve la posición del primer carácter no blanco a partir de start"""
+    end = len(text)
+    while start < end and text[start].isspace():
+        start += 1
+    return start
+
+def _extract_json_object(text: str, start: int) -> Optional[str]:
+    """
+    Devuelve el objeto JSON que empieza en text[start] ('{'), siguiendo la
+    profundidad de llaves e ignorando las que aparecen dentro de cadenas.
+    Devuelve None si el objeto no se cierra.
+    """
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+# Hilo para trabajo de E/S que se solapa con la preparación de cada tarea;
+# uno solo para que las cachés de memoria no se usen desde dos hilos a la vez
+_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# Rutas resueltas una sola vez al importar
+SCRIPT_DIR = Path(__file__).resolve().parent
+MEMORY_PATH = SCRIPT_DIR / CONFIG.MEMORY_DIR
+TOOLS_PATH = SCRIPT_DIR / CONFIG.TOOLS_DIR
+API_KEYS_PATH = SCRIPT_DIR / CONFIG.API_KEYS_FILE
+
 class ModelProvider(Enum):
     """Proveedores de modelos disponibles"""
     GEMINI = "gemini"
     OLLAMA = "ollama"
     UNKNOWN = "unknown"
 
+# Roles del historial, internados para compartir una única instancia
+ROLE_USER = sys.intern("user")
+ROLE_MODEL = sys.intern("model")
+
+# Herramientas de control del bucle de turnos y la acción que desencadenan
+_CONTROL_TOOLS = {'finish_task': 'finish', 'request_more_steps': 'more_steps'}
+
+class HistoryMessage(dict):
+    """
+    Mensaje {'role', 'parts'} del historial. `seq` identifica la entrada de la que
+    procede (0 para el prompt del sistema) y no forma parte del contenido enviado.
+    """
+    __slots__ = ('seq',)
+    
+    def __init__(self, seq: int, role: str, parts: List[str]):
+        super().__init__(role=role, parts=parts)
+        self.seq = seq
+
 @dataclass
 class TaskContext:
     """Contexto de una tarea en curso"""
     task_id: Optional[str] = None
-    turn_history: List[Dict[str, Any]] = field(default_factory=list)
-    start_time: datetime.datetime = field(default_factory=datetime.datetime.now)
+    # Prompt del sistema y tarea; se conserva aunque el historial se recorte
+    system_parts: Tuple[str, ...] = ()
+    # Turnos (número de secuencia, rol, texto) en una ventana deslizante acotada
+    turn_history: Deque[Tuple[int, str, str]] = field(
+        default_factory=lambda: deque(maxlen=CONFIG.HISTORY_MAX_TURNS)
+    )
+    # Último número de secuencia asignado; nunca se reutiliza
+    _turn_seq: int = field(default=0, repr=False)
+    start_time_ns: int = field(default_factory=time.monotonic_ns)
+    _reset_hooks: List[Callable[[], None]] = field(default_factory=list, repr=False)
+    
+    @property
+    def elapsed_seconds(self) -> float:
+        """Segundos transcurridos desde el inicio de la tarea"""
+        return (time.monotonic_ns() - self.start_time_ns) / 1e9
+    
+    def add_turn(self, role: str, text: str) -> None:
+        """Añade un turno al historial (los más antiguos se descartan al llenarse)"""
+        self._turn_seq += 1
+        self.turn_history.append((self._turn_seq, role, text))
+    
+    def iter_messages(self) -> Iterator[HistoryMessage]:
+        """Genera el historial en el formato {'role', 'parts'} que esperan los modelos"""
+        if self.system_parts:
+            yield HistoryMessage(0, ROLE_USER, list(self.system_parts))
+        for seq, role, text in self.turn_history:
+            yield HistoryMessage(seq, role, [text])
+    
+    def add_reset_hook(self, hook: Callable[[], None]) -> None:
+        """Registra una función que se llama cada vez que se reinicia el contexto"""
+        self._reset_hooks.append(hook)
     
     def reset(self):
         """Reinicia el contexto de la tarea"""
         self.task_id = None
+        self.system_parts = ()
         self.turn_history.clear()
-        self.start_time = datetime.datetime.now()
+        self.start_time_ns = time.monotonic_ns()
+        for hook in self._reset_hooks:
+            hook()
+
+# ============================================================================
+# UTILIDADES DE ARCHIVOS
+# ============================================================================
+
+# Último contenido leído con éxito de cada archivo JSON
+_json_fallback: Dict[str, Dict[str, Any]] = {}
+
+@functools.lru_cache(maxsize=8)
+def _read_json_file(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Lee y parsea un archivo JSON; cacheado por ruta y fecha de modificación"""
+    with open(path, 'rb') as f:
+        return _loads(f.read())
+
+def load_json_cached(path: Path) -> Dict[str, Any]:
+    """
+    Carga un archivo JSON reutilizando el resultado mientras no cambie en disco.
+    Si el archivo no se puede leer, devuelve el último contenido válido conocido.
+    """
+    key = str(path)
+    try:
+        data = _read_json_file(key, path.stat().st_mtime_ns)
+    except OSError:
+        return _json_fallback.get(key, {})
+    
+    _json_fallback[key] = data
+    return data
+
+_LOCAL_HOSTNAMES = frozenset({"localhost", "127.0.0.1", "::1", "0.0.0.0"})
+
+def _ollama_local_address(host: str) -> Optional[Tuple[str, int]]:
+    """
+    (hostname, puerto) del servidor de Ollama si es local; None si es remoto,
+    en cuyo caso el almacén de modelos de esta máquina no lo describe.
+    """
+    parts = urlsplit(host if "://" in host else f"http://{host}")
+    if parts.hostname not in _LOCAL_HOSTNAMES:
+        return None
+    return parts.hostname, parts.port or 11434
+
+def _ollama_models_signature() -> Optional[int]:
+    """
+    Firma del almacén local de modelos de Ollama: la mayor fecha de modificación
+    de los directorios de manifiestos. None si el almacén no es accesible.
+    """
+    default_root = Path.home() / ".ollama" / "models"
+    manifests = Path(os.getenv("OLLAMA_MODELS", default_root)) / "manifests"
+    try:
+        signature = manifests.stat().st_mtime_ns
+    except OSError:
+        return None
+    
+    for dirpath, _, _ in os.walk(manifests):
+        try:
+            signature = max(signature, os.stat(dirpath).st_mtime_ns)
+        except OSError:
+            continue
+    return signature
 
 # ============================================================================
 # SISTEMA DE LOGGING MEJORADO
@@ -123,14 +340,20 @@ def setup_logging() -> logging.Logger:
     agent_logger = logging.getLogger("agent")
     agent_logger.setLevel(logging.DEBUG)
     
-    # Handler para archivo
+    # Handler para archivo, escrito desde un hilo aparte a través de una cola
     file_handler = logging.FileHandler(CONFIG.LOG_FILE, encoding='utf-8')
     file_handler.setLevel(logging.DEBUG)
     file_formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     file_handler.setFormatter(file_formatter)
-    agent_logger.addHandler(file_handler)
+    
+    log_queue = queue.SimpleQueue()
+    agent_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
     
     return agent_logger
 
@@ -138,6 +361,11 @@ def setup_logging() -> logging.Logger:
 logger = setup_logging()
 console = Console()
 
+# Estilos precalculados para los avisos de una línea del bucle de turnos
+_STEP_STYLE = Style(color="cyan", bold=True)
+_SUCCESS_STYLE = Style(color="green", bold=True)
+_LIMIT_STYLE = Style(color="red", bold=True)
+
 # ============================================================================
 # EXCEPCIONES PERSONALIZADAS
 # ============================================================================
@@ -158,6 +386,18 @@ class ToolExecutionError(Exception):
 # GESTOR DE MODELOS
 # ============================================================================
 
+class OllamaResponse:
+    """Respuesta de Ollama adaptada a la interfaz de las respuestas de Gemini"""
+    
+    def __init__(self, json_content: str):
+        self.text = json_content
+        self.candidates = []
+        # Ollama responde en modo JSON: se parsea una sola vez aquí
+        try:
+            self.parsed = _loads(json_content)
+        except (ValueError, TypeError):
+            self.parsed = None
+
 class ModelManager:
     """Gestor centralizado de modelos de IA"""
     
@@ -168,6 +408,42 @@ class ModelManager:
         self.api_keys: List[str] = []
         self._available_models_cache: Dict[str, List[str]] = {}
         self.tool_manager = tool_manager
+        
+        # Módulos de Google AI, importados en _setup_gemini
+        self._genai: Optional[ModuleType] = None
+        self._google_exceptions: Optional[ModuleType] = None
+        self._glm: Optional[ModuleType] = None
+        
+        # Un GenerativeModel por API key, construidos una sola vez
+        self._gemini_clients: List[Any] = []
+        self._gemini_tool_config: Optional[Any] = None
+        
+        # Declaraciones de herramientas para Gemini, válidas para una versión de ToolManager
+        self._gemini_tools_cache: Optional[list] = None
+        self._tools_cached_version: int = -1
+        
+        # Mensajes de Ollama ya convertidos desde el historial de la tarea
+        self._ollama_msg_cache: List[Dict[str, str]] = []
+        # Número de secuencia de cada entrada convertida, para alinear la caché con el historial
+        self._ollama_msg_seqs: List[int] = []
+        
+        # Clientes de Ollama con conexiones persistentes, creados en el primer uso
+        self._ollama: Optional[Any] = None
+        self._async_ollama: Optional[Any] = None
+    
+    @property
+    def ollama_client(self):
+        """Cliente de Ollama compartido (reutiliza las conexiones HTTP)"""
+        if self._ollama is None:
+            self._ollama = ollama.Client(host=CONFIG.OLLAMA_HOST)
+        return self._ollama
+    
+    @property
+    def async_ollama(self):
+        """Cliente asíncrono de Ollama compartido"""
+        if self._async_ollama is None:
+            self._async_ollama = ollama.AsyncClient(host=CONFIG.OLLAMA_HOST)
+        return self._async_ollama
     
     def initialize(self) -> bool:
         """Inicializa los modelos disponibles"""
@@ -192,9 +468,18 @@ class ModelManager:
     
     def _setup_gemini(self) -> bool:
         """Configura Gemini si está disponible"""
-        if not GOOGLE_AI_AVAILABLE:
-            logger.debug("Google AI no está disponible")
+        try:
+            import google.generativeai as genai
+            import google.generativeai.protos
+            import google.ai.generativelanguage as glm
+            from google.api_core import exceptions as google_exceptions
+        except ImportError:
+            logger.warning("Google AI no está disponible. Solo se usará Ollama.")
             return False
+        
+        self._genai = genai
+        self._google_exceptions = google_exceptions
+        self._glm = glm
             
         try:
             # Cargar API keys
@@ -218,7 +503,11 @@ class ModelManager:
                 self.gemini_model = available_models[0]
             
             logger.info(f"Modelo Gemini seleccionado: {self.gemini_model}")
-            return self.gemini_model is not None
+            if self.gemini_model is None:
+                return False
+            
+            self._build_gemini_clients()
+            return True
             
         except Exception as e:
             logger.error(f"Error configurando Gemini: {e}")
@@ -227,7 +516,7 @@ class ModelManager:
     def _setup_ollama(self) -> bool:
         """Configura Ollama"""
         try:
-            local_models = ollama.list()['models']
+            local_models = self._list_ollama_models()
             if not local_models:
                 logger.error("No se encontraron modelos en Ollama")
                 return False
@@ -245,18 +534,59 @@ class ModelManager:
             logger.error(f"Error configurando Ollama: {e}")
             return False
     
+    def _list_ollama_models(self) -> List[Dict[str, str]]:
+        """
+        Lista los modelos locales de Ollama reutilizando una instantánea en disco
+        mientras el almacén de modelos no haya cambiado. Con un servidor remoto
+        siempre se consulta al servidor.
+        """
+        host = CONFIG.OLLAMA_HOST
+        address = _ollama_local_address(host)
+        signature = _ollama_models_signature() if address else None
+        snapshot_path = MEMORY_PATH / CONFIG.OLLAMA_LIST_CACHE_FILE
+        
+        if signature is not None:
+            try:
+                with open(snapshot_path, 'rb') as f:
+                    snapshot = pickle.load(f)
+                if (snapshot['host'] == host and snapshot['signature'] == signature
+                        and self._ollama_reachable(address)):
+                    logger.debug("Lista de modelos de Ollama obtenida de la caché")
+                    return snapshot['models']
+            except (OSError, pickle.PickleError, EOFError, KeyError, TypeError):
+                pass
+        
+        models = [{'model': m['model']} for m in self.ollama_client.list()['models']]
+        
+        if signature is not None:
+            try:
+                MEMORY_PATH.mkdir(exist_ok=True)
+                tmp_path = snapshot_path.with_suffix('.tmp')
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump({'host': host, 'signature': signature, 'models': models}, f)
+                os.replace(tmp_path, snapshot_path)
+            except OSError as e:
+                logger.debug(f"No se pudo guardar la lista de modelos de Ollama: {e}")
+        
+        return models
+    
+    @staticmethod
+    def _ollama_reachable(address: Tuple[str, int]) -> bool:
+        """
+        Comprueba que el servidor local acepta conexiones. Si no, la lista se pide
+        al cliente, que informa del error igual que sin instantánea.
+        """
+        try:
+            with socket.create_connection(address, timeout=1.0):
+                return True
+        except OSError:
+            return False
+    
     def _load_api_keys(self) -> List[str]:
         """Carga las API keys desde archivo"""
         try:
-            script_dir = Path(__file__).parent
-            keys_file = script_dir / CONFIG.API_KEYS_FILE
-            
-            if keys_file.exists():
-                with open(keys_file, 'r') as f:
-                    keys_data = json.load(f)
-                    return keys_data.get("gemini_api_keys", [])
-            
-            return []
+            keys_data = load_json_cached(API_KEYS_PATH)
+            return list(keys_data.get("gemini_api_keys", []))
         except Exception as e:
             logger.error(f"Error cargando API keys: {e}")
             return []
@@ -278,7 +608,7 @@ class ModelManager:
                 console.print("[red]Entrada inválida[/red]")
     
     def get_query_function(self) -> Callable:
-        """Obtiene la función de consulta según el proveedor actual"""
+        """Obtiene la función de consulta (asíncrona) según el proveedor actual"""
         if self.current_provider == ModelProvider.GEMINI:
             return self._query_gemini
         elif self.current_provider == ModelProvider.OLLAMA:
@@ -286,66 +616,136 @@ class ModelManager:
         else:
             raise ModelNotAvailableError("No hay proveedor configurado")
     
-    def _query_gemini(self, history: List[Dict], model_name: str, api_keys: List[str], turn: int):
-        """Consulta al modelo Gemini"""
-        current_key = self.api_keys[turn % len(self.api_keys)]
-        genai.configure(api_key=current_key)
-        
-        model = genai.GenerativeModel(
-            model_name, 
-            safety_settings={
-                'HARM_CATEGORY_HARASSMENT': 'block_none', 
-                'HARM_CATEGORY_DANGEROUS_CONTENT': 'block_none'
-            }
+    def reset_history_cache(self) -> None:
+        """Descarta los mensajes convertidos de la tarea anterior"""
+        self._ollama_msg_cache = []
+        self._ollama_msg_seqs = []
+    
+    def _sync_ollama_cache(self, history: List[Dict]) -> int:
+        """
+        Alinea la caché de mensajes con el historial recibido, que es una ventana
+        deslizante (la primera entrada fija y las más antiguas descartadas).
+        Devuelve el índice de la primera entrada del historial aún no convertida.
+        """
+        seqs = self._ollama_msg_seqs
+        if not seqs:
+            return 0
+        
+        # Cada entrada lleva el número de secuencia que le asignó TaskContext
+        last = seqs[-1]
+        for i in range(len(history) - 1, -1, -1):
+            if getattr(history[i], 'seq', None) == last:
+                start = i + 1
+                break
+        else:
+            self.reset_history_cache()
+            return 0
+        
+        # Quitar de la caché las entradas que ya salieron de la ventana
+        evicted = len(seqs) - start
+        if evicted > 0:
+            del self._ollama_msg_cache[1:1 + evicted]
+            del seqs[1:1 + evicted]
+        return start
+    
+    def _build_gemini_clients(self) -> None:
+        """Construye un GenerativeModel por API key para rotarlas sin reconfigurar"""
+        genai = self._genai
+        tools = self._get_gemini_tools()
+        
+        self._gemini_tool_config = genai.protos.ToolConfig(
+            function_calling_config=genai.protos.FunctionCallingConfig(mode="ANY")
         )
         
+        # El cliente de cada modelo se asigna al primer uso (_gemini_model_for)
+        self._gemini_clients = [
+            genai.GenerativeModel(
+                self.gemini_model,
+                safety_settings=CONFIG.GEMINI_SAFETY_SETTINGS,
+                tools=tools
+            )
+            for _ in self.api_keys
+        ]
+        
+        logger.debug(f"Clientes Gemini construidos: {len(self._gemini_clients)}")
+    
+    def _gemini_model_for(self, turn: int):
+        """
+        Devuelve el modelo de la API key que corresponde al turno. Único punto que
+        toca el atributo privado del SDK: cada modelo recibe su propio cliente
+        asíncrono con su key, creado dentro del event loop que lo va a usar.
+        """
+        index = turn % len(self._gemini_clients)
+        model = self._gemini_clients[index]
+        if model._async_client is None:
+            model._async_client = self._glm.GenerativeServiceAsyncClient(
+                client_options={'api_key': self.api_keys[index]}
+            )
+        return model
+    
+    async def _query_gemini(self, history: List[Dict], model_name: str, api_keys: List[str], turn: int):
+        """Consulta al modelo Gemini"""
+        # Las herramientas van integradas en los modelos: reconstruir si cambiaron
+        if self.tool_manager and self._tools_cached_version != self.tool_manager._version:
+            self._build_gemini_clients()
+        
+        model = self._gemini_model_for(turn)
+        
         try:
-            response = model.generate_content(
+            response = await model.generate_content_async(
                 history,
-                tools=self._get_gemini_tools(),
-                tool_config=ToolConfig(function_calling_config=FunctionCallingConfig(mode="ANY"))
+                tool_config=self._gemini_tool_config
             )
             return response
             
-        except exceptions.ResourceExhausted as e:
+        except self._google_exceptions.ResourceExhausted as e:
             raise GeminiQuotaExceededError("Cuota de Gemini excedida") from e
         except Exception as e:
             logger.error(f"Error consultando Gemini: {e}")
             raise
     
-    def _query_ollama(self, history: List[Dict], model_name: str, api_keys: List[str], turn: int):
+    async def _query_ollama(self, history: List[Dict], model_name: str, api_keys: List[str], turn: int):
         """Consulta al modelo Ollama"""
-        messages = []
-        for item in history:
-            role = 'assistant' if item['role'] == 'model' else 'user'
-            content = "\n".join(item['parts'])
-            messages.append({'role': role, 'content': content})
+        # Convertir solo los turnos nuevos; el prefijo ya está en caché
+        start = self._sync_ollama_cache(history)
+        
+        self._ollama_msg_cache.extend(
+            {'role': 'assistant' if item['role'] == ROLE_MODEL else 'user',
+             'content': "\n".join(item['parts'])}
+            for item in history[start:]
+        )
+        self._ollama_msg_seqs.extend(getattr(item, 'seq', None) for item in history[start:])
         
         # Forzar salida JSON
-        response = ollama.chat(model=model_name, messages=messages, format='json')
+        response = await self.async_ollama.chat(
+            model=model_name, messages=self._ollama_msg_cache, format='json'
+        )
         
         # Adaptar respuesta al formato esperado
-        class OllamaResponse:
-            def __init__(self, json_content):
-                self.text = json_content
-                self.candidates = []
-        
         return OllamaResponse(response['message']['content'])
     
     def _get_gemini_tools(self):
         """Obtiene las herramientas para Gemini"""
+        if (self._gemini_tools_cache is not None and self.tool_manager and
+                self._tools_cached_version == self.tool_manager._version):
+            return self._gemini_tools_cache
+        
         gemini_tools = []
         if self.tool_manager:
-            for tool_name, tool_func in self.tool_manager.tools.items():
-                if hasattr(tool_func, '_is_tool') and tool_func._is_tool:
-                    metadata = tool_func._tool_metadata
-                    gemini_tools.append(
-                        FunctionDeclaration(
-                            name=metadata['name'],
-                            description=metadata['description'],
-                            parameters=metadata['parameters']
-                        )
-                    )
+            FunctionDeclaration = self._genai.protos.FunctionDeclaration
+            for _, metadata in self.tool_manager._tool_decls:
+                declaration = {
+                    'name': metadata['name'],
+                    'description': metadata['description']
+                }
+                # Sin argumentos no se declaran parámetros (Gemini rechaza OBJECT vacíos)
+                if metadata.get('parameters', {}).get('properties'):
+                    declaration['parameters'] = metadata['parameters']
+                gemini_tools.append(FunctionDeclaration(**declaration))
+        
+        if self.tool_manager:
+            self._gemini_tools_cache = gemini_tools
+            self._tools_cached_version = self.tool_manager._version
         return gemini_tools
 
 # ============================================================================
@@ -356,9 +756,26 @@ class MemoryManager:
     """Gestor de memoria a largo plazo usando ChromaDB"""
     
     def __init__(self):
-        self.client: Optional[chromadb.PersistentClient] = None
-        self.collection: Optional[chromadb.Collection] = None
+        self.client: Optional["chromadb.PersistentClient"] = None
+        self.collection: Optional["chromadb.Collection"] = None
         self.model_manager: Optional[ModelManager] = None
+        
+        # Caché de embeddings: memoria (LRU acotada) + disco (shelve)
+        self._embedding_cache: Dict[bytes, Tuple[float, ...]] = {}
+        self._embedding_store: Optional[shelve.Shelf] = None
+        self._embedding_hits = 0
+        self._embedding_misses = 0
+        
+        # Escrituras pendientes, se envían a ChromaDB por lotes
+        self._pending_embeddings: List[List[float]] = []
+        self._pending_docs: List[str] = []
+        self._pending_meta: List[Dict] = []
+        self._pending_ids: List[str] = []
+        # Protege las listas pendientes: se guardan y vacían desde varios hilos
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # Se incrementa con cada recuerdo guardado (invalida cachés de consultas)
+        self.version = 0
     
     def initialize(self, model_manager: ModelManager) -> bool:
         """Inicializa el sistema de memoria"""
@@ -366,13 +783,26 @@ class MemoryManager:
             self.model_manager = model_manager
             
             # Crear directorio de memoria
-            memory_path = Path(__file__).parent / CONFIG.MEMORY_DIR
+            memory_path = MEMORY_PATH
             memory_path.mkdir(exist_ok=True)
             
+            # Abrir caché persistente de embeddings
+            try:
+                self._embedding_store = shelve.open(
+                    str(memory_path / CONFIG.EMBEDDING_CACHE_FILE)
+                )
+            except Exception as e:
+                logger.warning(f"Caché de embeddings en disco no disponible: {e}")
+            atexit.register(self.close)
+            
             # Inicializar cliente ChromaDB
-            self.client = chromadb.PersistentClient(path=str(memory_path))
+            self.client = chromadb.PersistentClient(
+                path=str(memory_path),
+                settings=chromadb.Settings(anonymized_telemetry=False)
+            )
             self.collection = self.client.get_or_create_collection(
-                name="long_term_memory"
+                name="long_term_memory",
+                metadata=CONFIG.MEMORY_HNSW_SETTINGS
             )
             
             logger.info("Sistema de memoria inicializado correctamente")
@@ -392,13 +822,20 @@ class MemoryManager:
             embedding = self._generate_embedding(text)
             memory_id = str(uuid.uuid4())
             
-            # Guardar en ChromaDB
-            self.collection.add(
-                embeddings=[embedding],
-                documents=[text],
-                metadatas=[metadata or {}],
-                ids=[memory_id]
-            )
+            # Encolar para ChromaDB; se escribe por lotes
+            with self._pending_lock:
+                self._pending_embeddings.append(embedding)
+                self._pending_docs.append(text)
+                self._pending_meta.append(metadata or {})
+                self._pending_ids.append(memory_id)
+                self.version += 1
+                should_flush = (
+                    len(self._pending_ids) >= CONFIG.MEMORY_BATCH_SIZE or
+                    time.monotonic() - self._last_flush >= CONFIG.MEMORY_FLUSH_INTERVAL
+                )
+            
+            if should_flush:
+                self.flush()
             
             logger.debug(f"Recuerdo guardado: {text[:50]}...")
             return "Éxito: Recuerdo guardado"
@@ -407,9 +844,22 @@ class MemoryManager:
             logger.error(f"Error guardando recuerdo: {e}")
             return f"Error guardando recuerdo: {e}"
     
+    def has_memories(self) -> bool:
+        """Indica si hay recuerdos en los que buscar (sin generar embeddings)"""
+        try:
+            # Los recuerdos pendientes deben contar
+            self.flush()
+            return bool(self.collection) and self.collection.count() > 0
+        except Exception as e:
+            logger.error(f"Error consultando la memoria: {e}")
+            return False
+    
     def retrieve_memories(self, prompt: str, n_results: int = 3) -> str:
         """Recupera recuerdos relevantes basados en un prompt"""
         try:
+            # Los recuerdos pendientes deben ser visibles para la búsqueda
+            self.flush()
+            
             if not self.collection or self.collection.count() == 0:
                 return "No hay recuerdos guardados"
             
@@ -430,20 +880,197 @@ class MemoryManager:
             logger.error(f"Error recuperando recuerdos: {e}")
             return f"Error recuperando recuerdos: {e}"
     
+    def flush(self) -> None:
+        """Escribe en ChromaDB todos los recuerdos pendientes en un solo lote"""
+        with self._pending_lock:
+            self._last_flush = time.monotonic()
+            if not self._pending_ids or not self.collection:
+                return
+            
+            embeddings, self._pending_embeddings = self._pending_embeddings, []
+            documents, self._pending_docs = self._pending_docs, []
+            metadatas, self._pending_meta = self._pending_meta, []
+            ids, self._pending_ids = self._pending_ids, []
+            
+            # Dentro del cerrojo: una búsqueda tras flush() ve el lote completo
+            self.collection.add(
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids
+            )
+        logger.debug(f"Lote de {len(ids)} recuerdos escrito en memoria")
+    
+    def close(self) -> None:
+        """Cierra los recursos persistentes del sistema de memoria"""
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error escribiendo recuerdos pendientes: {e}")
+        
+        if self._embedding_store is not None:
+            try:
+                self._embedding_store.close()
+            except Exception as e:
+                logger.error(f"Error cerrando caché de embeddings: {e}")
+            self._embedding_store = None
+    
+    def embed(self, text: str) -> List[float]:
+        """Genera (o reutiliza de la caché) el embedding de un texto"""
+        return self._generate_embedding(text)
+    
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Genera (o reutiliza de la caché) los embeddings de varios textos.
+        Todos pasan por /api/embeddings como el resto de rutas: /api/embed sí admite
+        lotes, pero devuelve vectores normalizados que no son comparables con los
+        guardados en la caché y en las colecciones existentes.
+        """
+        return [self._generate_embedding(text) for text in texts]
+    
     def _generate_embedding(self, text: str) -> List[float]:
-        """Genera un embedding para el texto dado"""
+        """Genera un embedding para el texto dado, reutilizando la caché"""
+        key = self._embedding_key(text)
+        cached = self._get_cached_embedding(key)
+        if cached is not None:
+            return list(cached)
+        
         try:
             # Usar Ollama para embeddings por defecto
-            response = ollama.embeddings(
+            response = self.model_manager.ollama_client.embeddings(
                 model=CONFIG.OLLAMA_EMBEDDING_MODEL, 
                 prompt=text
             )
-            return response['embedding']
             
         except Exception as e:
             logger.error(f"Error generando embedding: {e}")
-            # Fallback a vector de ceros
+            # Fallback a vector de ceros (no se guarda en caché)
             return [0.0] * 768
+        
+        return list(self._store_embedding(key, response['embedding']))
+    
+    @staticmethod
+    def _embedding_key(text: str) -> bytes:
+        """Clave de caché de un texto; incluye el modelo para no mezclar vectores de modelos distintos"""
+        hasher = hashlib.blake2b(CONFIG.OLLAMA_EMBEDDING_MODEL.encode('utf-8'), digest_size=16)
+        hasher.update(b'\0')
+        hasher.update(text.encode('utf-8'))
+        return hasher.digest()
+    
+    def _get_cached_embedding(self, key: bytes) -> Optional[Tuple[float, ...]]:
+        """Busca un embedding en la caché en memoria y después en disco"""
+        cached = self._embedding_cache.pop(key, None)
+        if cached is None and self._embedding_store is not None:
+            cached = self._embedding_store.get(key.hex())
+        
+        if cached is None:
+            self._embedding_misses += 1
+            return None
+        
+        self._embedding_hits += 1
+        self._remember_embedding(key, cached)
+        logger.debug(
+            f"Embedding en caché (aciertos: {self._embedding_hits}, "
+            f"fallos: {self._embedding_misses})"
+        )
+        return cached
+    
+    def _store_embedding(self, key: bytes, embedding: List[float]) -> Tuple[float, ...]:
+        """Guarda un embedding recién generado en ambas cachés"""
+        embedding = tuple(embedding)
+        self._remember_embedding(key, embedding)
+        if self._embedding_store is not None:
+            try:
+                self._embedding_store[key.hex()] = embedding
+            except Exception as e:
+                logger.debug(f"No se pudo persistir el embedding: {e}")
+        return embedding
+    
+    def _remember_embedding(self, key: bytes, embedding: Tuple[float, ...]) -> None:
+        """Inserta un embedding en la caché en memoria, expulsando el más antiguo"""
+        self._embedding_cache[key] = embedding
+        if len(self._embedding_cache) > CONFIG.EMBEDDING_CACHE_SIZE:
+            self._embedding_cache.pop(next(iter(self._embedding_cache)))
+
+class MemoryQueryCache:
+    """
+    Caché semántica de recuperaciones de memoria: reutiliza el resultado de una
+    consulta anterior si su embedding es casi idéntico (similitud coseno >= umbral).
+    Los candidatos se localizan con LSH (signo de proyecciones aleatorias),
+    consultando también las cubetas a distancia de Hamming 1.
+    """
+    
+    def __init__(self, max_size: int = CONFIG.MEMORY_QUERY_CACHE_SIZE,
+                 threshold: float = CONFIG.MEMORY_QUERY_CACHE_SIMILARITY,
+                 n_bits: int = CONFIG.MEMORY_QUERY_CACHE_LSH_BITS):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.n_bits = n_bits
+        # id de entrada -> (embedding normalizado, cubeta LSH, recuerdos); orden LRU
+        self._entries: "OrderedDict[int, Tuple[Any, int, str]]" = OrderedDict()
+        self._buckets: Dict[int, List[int]] = {}
+        self._projections: Optional[Any] = None
+        self._next_id = 0
+    
+    def clear(self) -> None:
+        """Vacía la caché"""
+        self._entries.clear()
+        self._buckets.clear()
+    
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        """Devuelve los recuerdos cacheados de una consulta similar, si existe"""
+        vector = self._normalize(embedding)
+        if vector is None or not self._entries:
+            return None
+        
+        bucket = self._bucket(vector)
+        probes = [bucket] + [bucket ^ (1 << bit) for bit in range(self.n_bits)]
+        for probe in probes:
+            for entry_id in self._buckets.get(probe, ()):
+                cached_vector, _, memories = self._entries[entry_id]
+                if float(cached_vector @ vector) >= self.threshold:
+                    self._entries.move_to_end(entry_id)
+                    return memories
+        return None
+    
+    def insert(self, embedding: List[float], memories: str) -> None:
+        """Guarda el resultado de una consulta, expulsando la menos usada si está llena"""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        
+        bucket = self._bucket(vector)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (vector, bucket, memories)
+        self._buckets.setdefault(bucket, []).append(entry_id)
+        
+        if len(self._entries) > self.max_size:
+            old_id, (_, old_bucket, _) = self._entries.popitem(last=False)
+            self._buckets[old_bucket].remove(old_id)
+            if not self._buckets[old_bucket]:
+                del self._buckets[old_bucket]
+    
+    def _normalize(self, embedding: List[float]) -> Optional[Any]:
+        """Normaliza el embedding; None para vectores nulos (embeddings fallidos)"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+    
+    def _bucket(self, vector: Any) -> int:
+        """Cubeta LSH: bits de signo de las proyecciones aleatorias"""
+        if self._projections is None or self._projections.shape[1] != vector.shape[0]:
+            rng = np.random.default_rng(0)
+            self._projections = rng.standard_normal(
+                (self.n_bits, vector.shape[0])
+            ).astype(np.float32)
+            self.clear()
+        bucket = 0
+        for bit in (self._projections @ vector > 0):
+            bucket = (bucket << 1) | int(bit)
+        return bucket
 
 from agent_tools.tool_decorator import tool
 
@@ -457,15 +1084,45 @@ from agent_tools.tool_decorator import tool
 
 
 
+# Tipos de anotación Python -> tipos de esquema de Gemini
+_AST_TYPE_MAP: Dict[str, str] = {
+    'str': 'STRING',
+    'int': 'INTEGER',
+    'float': 'NUMBER',
+    'bool': 'BOOLEAN',
+    'list': 'ARRAY',
+    'List': 'ARRAY',
+    'Sequence': 'ARRAY',
+    'tuple': 'ARRAY',
+    'Tuple': 'ARRAY',
+    'dict': 'OBJECT',
+    'Dict': 'OBJECT',
+    'Mapping': 'OBJECT',
+}
+
+
 class ToolManager:
     """Gestor de herramientas dinámicas y estáticas"""
     
     def __init__(self):
         self.tools: Dict[str, Callable] = {}
+        # Índice de herramientas dinámicas aún no importadas: nombre -> (archivo, metadatos)
+        self._tool_index: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        # Declaraciones (nombre, metadatos) de las herramientas marcadas con @tool
+        self._tool_decls: List[Tuple[str, Dict[str, Any]]] = []
+        # Protege los registros concurrentes (indexado e importación bajo demanda)
+        self._lock = threading.Lock()
         self.static_tools_initialized = False
+        # Evita repetir la carga si initialize() se llama más de una vez
+        self._initialized = False
+        # Se incrementa cada vez que cambia el conjunto de herramientas
+        self._version = 0
     
     def initialize(self) -> bool:
-        """Inicializa el gestor de herramientas"""
+        """Inicializa el gestor de herramientas (idempotente)"""
+        if self._initialized:
+            return True
+        
         try:
             # Cargar herramientas estáticas
             self._initialize_static_tools()
@@ -473,7 +1130,8 @@ class ToolManager:
             # Cargar herramientas dinámicas
             self._load_dynamic_tools()
             
-            logger.info(f"Herramientas cargadas: {list(self.tools.keys())}")
+            logger.info(f"Herramientas cargadas: {self.tool_names}")
+            self._initialized = True
             return True
             
         except Exception as e:
@@ -486,7 +1144,7 @@ class ToolManager:
         def write_file(file_path: str, content: str) -> str:
             """Escribe o reescribe un archivo"""
             try:
-                full_path = Path(__file__).parent / file_path
+                full_path = SCRIPT_DIR / file_path
                 full_path.parent.mkdir(parents=True, exist_ok=True)
                 
                 with open(full_path, 'w', encoding='utf-8') as f:
@@ -502,7 +1160,7 @@ class ToolManager:
         def read_file(file_path: str) -> str:
             """Lee el contenido de un archivo"""
             try:
-                full_path = Path(__file__).parent / file_path
+                full_path = SCRIPT_DIR / file_path
                 
                 if not full_path.exists():
                     return f"Error: El archivo '{file_path}' no existe"
@@ -525,7 +1183,7 @@ class ToolManager:
                     shell=True, 
                     capture_output=True, 
                     text=True,
-                    cwd=Path(__file__).parent
+                    cwd=SCRIPT_DIR
                 )
                 
                 output = f"STDOUT:\n{result.stdout}"
@@ -567,13 +1225,30 @@ class ToolManager:
             'request_more_steps': request_more_steps,
             'return_text': return_text
         })
+        for name, tool_func in self.tools.items():
+            if getattr(tool_func, '_is_tool', False):
+                self._register_decl(name, tool_func._tool_metadata)
+        self._version += 1
         
         self.static_tools_initialized = True
     
+    @property
+    def tool_names(self) -> List[str]:
+        """Nombres de todas las herramientas, importadas o solo indexadas"""
+        return list(dict.fromkeys([*self.tools, *self._tool_index]))
+    
+    def _register_decl(self, name: str, metadata: Dict[str, Any]) -> None:
+        """Añade o reemplaza la declaración de una herramienta"""
+        for i, (decl_name, _) in enumerate(self._tool_decls):
+            if decl_name == name:
+                self._tool_decls[i] = (name, metadata)
+                return
+        self._tool_decls.append((name, metadata))
+    
     def _load_dynamic_tools(self):
-        """Carga herramientas dinámicas desde el directorio agent_tools"""
+        """Indexa las herramientas dinámicas del directorio agent_tools sin importarlas"""
         try:
-            tools_dir = Path(__file__).parent / CONFIG.TOOLS_DIR
+            tools_dir = TOOLS_PATH
             
             if not tools_dir.exists():
                 logger.debug(f"Directorio de herramientas no existe: {tools_dir}")
@@ -582,48 +1257,196 @@ class ToolManager:
             # Añadir directorio al path de Python
             sys.path.insert(0, str(tools_dir.parent))
             
-            for file_path in tools_dir.glob("*.py"):
-                if file_path.name == "__init__.py":
-                    continue
-                
-                try:
-                    # Cargar módulo
-                    spec = importlib.util.spec_from_file_location(
-                        file_path.stem, file_path
-                    )
-                    if spec is None:
-                        continue
-                    
-                    module = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(module)
-                    
-                    # Buscar funciones con decorador @tool
-                    for name in dir(module):
-                        obj = getattr(module, name)
-                        if (inspect.isfunction(obj) and 
-                            hasattr(obj, '_is_tool') and 
-                            obj._is_tool):
-                            
-                            self.tools[name] = obj
-                            logger.debug(f"Herramienta dinámica cargada: {name}")
-                            
-                except Exception as e:
-                    logger.error(f"Error cargando herramienta {file_path.name}: {e}")
+            with os.scandir(tools_dir) as entries:
+                py_files = sorted(
+                    entry.path for entry in entries
+                    if entry.is_file(follow_symlinks=False)
+                    and entry.name.endswith('.py')
+                    and entry.name != '__init__.py'
+                )
+            
+            if not py_files:
+                return
+            
+            # Leer y analizar los archivos en paralelo; el orden de map() es determinista
+            with ThreadPoolExecutor(max_workers=min(8, len(py_files))) as executor:
+                results = list(executor.map(self._index_single_tool, py_files))
+            
+            with self._lock:
+                for file_tools in results:
+                    for name, file_path, metadata in file_tools:
+                        # Una herramienta dinámica reemplaza a la estática del mismo nombre:
+                        # se retira la estática para que se importe la dinámica al usarla
+                        self.tools.pop(name, None)
+                        self._tool_index[name] = (file_path, metadata)
+                        self._register_decl(name, metadata)
+                        self._version += 1
+                        logger.debug(f"Herramienta dinámica indexada: {name}")
                     
         except Exception as e:
             logger.error(f"Error cargando herramientas dinámicas: {e}")
     
-    def execute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> str:
-        """Ejecuta una herramienta con los parámetros dados"""
-        if tool_name not in self.tools:
-            available = list(self.tools.keys())
+    def _index_single_tool(self, file_path: str) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """Extrae (nombre, archivo, metadatos) de las funciones @tool de un archivo"""
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                module_ast = ast.parse(f.read(), filename=file_path)
+            
+            # Buscar funciones con decorador @tool
+            return [
+                (node.name, file_path, self._metadata_from_ast(node))
+                for node in module_ast.body
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                and any(self._is_tool_decorator(d) for d in node.decorator_list)
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error cargando herramienta {os.path.basename(file_path)}: {e}")
+            return []
+    
+    @staticmethod
+    def _is_tool_decorator(decorator: ast.expr) -> bool:
+        """Indica si un nodo decorador corresponde a @tool"""
+        target = decorator.func if isinstance(decorator, ast.Call) else decorator
+        if isinstance(target, ast.Name):
+            return target.id == 'tool'
+        if isinstance(target, ast.Attribute):
+            return target.attr == 'tool'
+        return False
+    
+    @staticmethod
+    def _metadata_from_ast(node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> Dict[str, Any]:
+        """Construye los metadatos de una herramienta a partir de su AST"""
+        positional = node.args.args
+        first_default = len(positional) - len(node.args.defaults)
+        
+        # (argumento, obligatorio) para posicionales y keyword-only
+        arguments = [(arg, i < first_default) for i, arg in enumerate(positional)]
+        arguments += [(arg, default is None)
+                      for arg, default in zip(node.args.kwonlyargs, node.args.kw_defaults)]
+        
+        properties = {}
+        required = []
+        for arg, is_required in arguments:
+            properties[arg.arg] = ToolManager._schema_from_annotation(arg.annotation)
+            if is_required:
+                required.append(arg.arg)
+        
+        metadata = {
+            'name': node.name,
+            'description': ast.get_docstring(node) or node.name
+        }
+        
+        # Gemini rechaza parámetros OBJECT sin propiedades: se omiten si no hay argumentos
+        if properties:
+            metadata['parameters'] = {'type': 'OBJECT', 'properties': properties}
+            if required:
+                metadata['parameters']['required'] = required
+        
+        return metadata
+    
+    @staticmethod
+    def _schema_from_annotation(annotation: Optional[ast.expr]) -> Dict[str, Any]:
+        """Traduce la anotación de un argumento a un esquema de Gemini (STRING por defecto)"""
+        # Anotaciones entre comillas: se analiza la expresión que contienen
+        if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str):
+            try:
+                annotation = ast.parse(annotation.value, mode='eval').body
+            except SyntaxError:
+                return {'type': 'STRING'}
+        
+        # X | None
+        if isinstance(annotation, ast.BinOp) and isinstance(annotation.op, ast.BitOr):
+            for side in (annotation.left, annotation.right):
+                if not (isinstance(side, ast.Constant) and side.value is None):
+                    return ToolManager._schema_from_annotation(side)
+        
+        if isinstance(annotation, ast.Subscript):
+            base = annotation.value
+            name = base.id if isinstance(base, ast.Name) else getattr(base, 'attr', '')
+            inner = annotation.slice
+            if sys.version_info < (3, 9):  # ast.Index envuelve el subíndice
+                inner = inner.value
+            args = list(inner.elts) if isinstance(inner, ast.Tuple) else [inner]
+            
+            # Optional[X] / Union[X, None]: se usa el primer tipo no nulo
+            if name in ('Optional', 'Union'):
+                for arg in args:
+                    if not (isinstance(arg, ast.Constant) and arg.value is None):
+                        return ToolManager._schema_from_annotation(arg)
+            
+            schema_type = _AST_TYPE_MAP.get(name, 'STRING')
+            if schema_type == 'ARRAY':
+                return {'type': 'ARRAY', 'items': ToolManager._schema_from_annotation(args[0])}
+            return {'type': schema_type}
+        
+        if isinstance(annotation, ast.Name):
+            name = annotation.id
+        elif isinstance(annotation, ast.Attribute):
+            name = annotation.attr
+        else:
+            return {'type': 'STRING'}
+        
+        schema_type = _AST_TYPE_MAP.get(name, 'STRING')
+        if schema_type == 'ARRAY':
+            return {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+        return {'type': schema_type}
+    
+    def _load_indexed_tool(self, tool_name: str) -> None:
+        """Importa una herramienta indexada si aún no lo está (seguro entre hilos)"""
+        with self._lock:
+            if tool_name not in self.tools:
+                self._import_tool_module(self._tool_index[tool_name][0])
+    
+    def _import_tool_module(self, file_path: str) -> None:
+        """Importa el módulo de una herramienta indexada y registra sus funciones"""
+        path = Path(file_path)
+        spec = importlib.util.spec_from_file_location(path.stem, path)
+        if spec is None:
+            raise ToolExecutionError(f"No se pudo cargar el módulo {path.name}")
+        
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        
+        for name in dir(module):
+            obj = getattr(module, name)
+            if (inspect.isfunction(obj) and 
+                hasattr(obj, '_is_tool') and 
+                obj._is_tool):
+                
+                # Los metadatos del decorador sustituyen a los deducidos del AST
+                metadata = getattr(obj, '_tool_metadata', None)
+                if metadata is not None:
+                    if (name, metadata) not in self._tool_decls:
+                        self._register_decl(name, metadata)
+                        self._version += 1
+                elif name not in self._tool_index:
+                    self._version += 1
+                self.tools[name] = obj
+                logger.debug(f"Herramienta dinámica cargada: {name}")
+    
+    def execute_tool(self, tool_name: str, parameters: Mapping[str, Any]) -> str:
+        """
+        Ejecuta una herramienta con los parámetros dados.
+        `parameters` puede ser el mapeo original del SDK y debe tratarse como
+        de solo lectura: se desempaqueta en la llamada sin copiarlo ni modificarlo.
+        """
+        if tool_name not in self.tools and tool_name not in self._tool_index:
+            available = self.tool_names
             return f"Error: Herramienta '{tool_name}' no encontrada. Disponibles: {available}"
         
         try:
+            # Importar bajo demanda las herramientas solo indexadas
+            if tool_name not in self.tools:
+                self._load_indexed_tool(tool_name)
+            
             tool_func = self.tools[tool_name]
             result = tool_func(**parameters)
+            # Las herramientas async se ejecutan en el hilo del ejecutor, sin bucle propio
+            if inspect.iscoroutine(result):
+                result = asyncio.run(result)
             logger.debug(f"Herramienta ejecutada: {tool_name}")
-            return result
+            return result if isinstance(result, str) else str(result)
             
         except Exception as e:
             logger.error(f"Error ejecutando herramienta {tool_name}: {e}")
@@ -642,6 +1465,15 @@ class TaskManager:
         self.tool_manager: Optional[ToolManager] = None
         self.current_task = TaskContext()
         self.system_prompt_template = self._create_system_prompt()
+        # Lista de herramientas ya formateada; el conjunto no cambia tras initialize()
+        self._available_tools_str = ""
+        # Recuperaciones de memoria recientes, reutilizadas para prompts similares
+        self._mem_cache = MemoryQueryCache()
+        self._mem_cache_version = 0
+        # Hasta que termine una recuperación no se aplica el límite de tiempo
+        self._memory_warm = False
+        # Recuperación en curso; puede seguir activa tras superar el límite de tiempo
+        self._memories_pending: Optional[Future] = None
     
     def initialize(self) -> bool:
         """Inicializa todos los componentes del sistema"""
@@ -653,6 +1485,7 @@ class TaskManager:
                 return False # If tools can't be loaded, we can't proceed with Gemini
             
             self.model_manager = ModelManager(tool_manager=self.tool_manager) # Pass initialized tool_manager
+            self.current_task.add_reset_hook(self.model_manager.reset_history_cache)
             self.memory_manager = MemoryManager()
             
             # Configurar componentes
@@ -662,23 +1495,22 @@ class TaskManager:
             if not self.memory_manager.initialize(self.model_manager):
                 logger.warning("Sistema de memoria no disponible")
             
-            if not self.tool_manager.initialize():
-                logger.warning("Sistema de herramientas no disponible")
+            self._available_tools_str = ", ".join(sorted(self.tool_manager.tool_names))
             
             logger.info("TaskManager inicializado correctamente")
             return True
             
         except Exception as e:
-            logger.error(f"Error inicializando TaskManager: {e}")
+            logger.error("Error inicializando TaskManager: %s", e)
             return False
     
-    def _create_system_prompt(self) -> str:
-        """Crea el prompt del sistema para el agente"""
-        return """
+    def _create_system_prompt(self) -> string.Template:
+        """Crea la plantilla del prompt del sistema para el agente"""
+        return string.Template("""
 Eres un asistente de programación autónomo y proactivo con memoria a largo plazo.
 
 HERRAMIENTAS DISPONIBLES:
-{available_tools}
+$available_tools
 
 INSTRUCCIONES:
 1. Analiza la tarea del usuario y toma la iniciativa
@@ -691,106 +1523,213 @@ INSTRUCCIONES:
 FORMATO DE RESPUESTA:
 Para usar una herramienta, responde EXACTAMENTE con:
 ```json
-{{
+{
   "tool_name": "nombre_de_la_herramienta",
-  "parameters": {{
+  "parameters": {
     "parametro1": "valor1",
     "parametro2": "valor2"
-  }}
-}}
+  }
+}
 ```
 
 MEMORIA RELEVANTE:
-{relevant_memories}
-"""
+$relevant_memories
+""")
     
-    def execute_task(self, user_prompt: str) -> None:
+    async def execute_task(self, user_prompt: str) -> None:
         """Ejecuta una tarea completa"""
         try:
             # Inicializar nueva tarea
             self.current_task.reset()
-            self.current_task.task_id = str(uuid.uuid4())
             
-            logger.info(f"Nueva tarea iniciada: {self.current_task.task_id}")
+            # Recuperar memorias relevantes en segundo plano mientras se prepara la tarea
+            loop = asyncio.get_running_loop()
+            memories_future = None
+            if self.memory_manager:
+                if self._memories_pending is not None and not self._memories_pending.done():
+                    logger.warning(
+                        "La recuperación de recuerdos anterior sigue en curso, se continúa sin ellos"
+                    )
+                else:
+                    self._memories_pending = _EXECUTOR.submit(
+                        self._retrieve_memories_cached, user_prompt
+                    )
+                    memories_future = asyncio.wrap_future(self._memories_pending, loop=loop)
+            
+            self.current_task.task_id = uuid.uuid4().hex
+            logger.info("Nueva tarea iniciada: %s", self.current_task.task_id)
+            task_part = f"Tarea: {user_prompt}"
             
-            # Recuperar memorias relevantes
             relevant_memories = ""
-            if self.memory_manager:
-                relevant_memories = self.memory_manager.retrieve_memories(user_prompt)
+            if memories_future is not None:
+                timeout = CONFIG.MEMORY_TIMEOUT if self._memory_warm else None
+                try:
+                    relevant_memories = await asyncio.wait_for(memories_future, timeout)
+                    self._memory_warm = True
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        "Recuperación de recuerdos superó %.1fs, se continúa sin ellos",
+                        CONFIG.MEMORY_TIMEOUT
+                    )
             
             # Preparar historial
-            available_tools = list(self.tool_manager.tools.keys()) if self.tool_manager else []
-            system_prompt = self.system_prompt_template.format(
-                available_tools=available_tools,
+            system_prompt = self.system_prompt_template.substitute(
+                available_tools=self._available_tools_str,
                 relevant_memories=relevant_memories
             )
             
-            self.current_task.turn_history = [
-                {'role': 'user', 'parts': [system_prompt, f"Tarea: {user_prompt}"]}
-            ]
+            self.current_task.system_parts = (system_prompt, task_part)
             
             # Ejecutar turnos
-            self._execute_turns()
+            await self._execute_turns()
             
         except Exception as e:
-            logger.error(f"Error ejecutando tarea: {e}")
+            logger.error("Error ejecutando tarea: %s", e)
             console.print(f"[red]Error: {e}[/red]")
     
-    def _execute_turns(self):
+    async def execute_tasks(self, prompts: List[str]) -> None:
+        """
+        Ejecuta una lista de tareas (p. ej. leídas de stdin). Los embeddings de
+        todos los prompts se calculan por adelantado y quedan en caché; las tareas se
+        ejecutan en orden porque comparten contexto y suelen depender entre sí.
+        """
+        if self.memory_manager and self.memory_manager.has_memories():
+            self.memory_manager.embed_many(prompts)
+        
+        for prompt in prompts:
+            await self.execute_task(prompt)
+    
+    def _retrieve_memories_cached(self, user_prompt: str) -> str:
+        """
+        Recupera recuerdos reutilizando los de un prompt anterior casi idéntico.
+        Un fallo no interrumpe la tarea: se continúa sin recuerdos.
+        """
+        try:
+            # Sin recuerdos no hay nada que buscar ni embedding que calcular
+            if not self.memory_manager.has_memories():
+                return "No hay recuerdos guardados"
+            
+            # Los recuerdos nuevos invalidan los resultados cacheados
+            if self._mem_cache_version != self.memory_manager.version:
+                self._mem_cache.clear()
+                self._mem_cache_version = self.memory_manager.version
+            
+            embedding = self.memory_manager.embed(user_prompt)
+            memories = self._mem_cache.lookup(embedding)
+            if memories is not None:
+                logger.debug("Recuerdos obtenidos de la caché semántica")
+                return memories
+            
+            memories = self.memory_manager.retrieve_memories(user_prompt)
+            if not memories.startswith("Error"):
+                self._mem_cache.insert(embedding, memories)
+            return memories
+            
+        except Exception as e:
+            logger.error("Error recuperando recuerdos: %s", e)
+            return ""
+    
+    async def _run_tools(self, tool_calls: List[Dict[str, Any]]) -> List[str]:
+        """Ejecuta en paralelo las llamadas a herramientas de una misma respuesta"""
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*[
+            loop.run_in_executor(
+                None,
+                functools.partial(
+                    self.tool_manager.execute_tool,
+                    tool_call['tool_name'],
+                    tool_call['parameters']
+                )
+            )
+            for tool_call in tool_calls
+        ])
+    
+    @staticmethod
+    def _banner(text: str, style: Style) -> None:
+        """Muestra un aviso de una línea; sin terminal se imprime como texto plano"""
+        if console.is_terminal:
+            console.rule(text, style=style)
+        else:
+            print(text)
+    
+    async def _execute_turns(self):
         """Ejecuta los turnos de la tarea"""
         steps_remaining = CONFIG.MAX_STEPS_PER_TASK
+        # Sin terminal (salida redirigida) no se lanza la animación de estado
+        interactive = console.is_terminal
+        
+        # Invariantes durante la tarea salvo cambio de proveedor
+        query_func = self.model_manager.get_query_function()
+        model_name = (self.model_manager.gemini_model or 
+                    self.model_manager.ollama_model)
+        api_keys = self.model_manager.api_keys
         
         while steps_remaining > 0:
             try:
                 step_num = CONFIG.MAX_STEPS_PER_TASK - steps_remaining + 1
-                console.print(Panel(f"Paso {step_num}", title="[bold cyan]Ejecutando[/bold cyan]"))
+                self._banner(f"Paso {step_num}", _STEP_STYLE)
                 
                 # Consultar modelo
-                query_func = self.model_manager.get_query_function()
-                model_name = (self.model_manager.gemini_model or 
-                            self.model_manager.ollama_model)
-                api_keys = self.model_manager.api_keys
-                
-                with console.status("[bold cyan]Pensando...[/bold cyan]"):
-                    response = query_func(
-                        self.current_task.turn_history, 
+                status = (console.status("[bold cyan]Pensando...[/bold cyan]")
+                          if interactive else contextlib.nullcontext())
+                with status:
+                    response = await query_func(
+                        list(self.current_task.iter_messages()), 
                         model_name, 
                         api_keys, 
                         step_num - 1
                     )
                 
                 # Parsear respuesta
-                tool_call = self._parse_model_response(response)
+                tool_calls = self._parse_model_response(response)
                 
-                if tool_call:
-                    # Ejecutar herramienta
-                    result = self.tool_manager.execute_tool(
-                        tool_call['tool_name'], 
-                        tool_call['parameters']
-                    )
+                if tool_calls:
+                    # Ejecutar herramientas (en paralelo si hay varias)
+                    results = await self._run_tools(tool_calls)
                     
-                    # Mostrar resultado
-                    console.print(Panel(
-                        result, 
-                        title=f"[bold green]{tool_call['tool_name']}[/bold green]"
-                    ))
+                    task_finished = False
+                    for index, (tool_call, result) in enumerate(zip(tool_calls, results)):
+                        # Mostrar resultado; los muy largos se escriben directamente
+                        if len(result) > CONFIG.RESULT_STREAM_THRESHOLD:
+                            console.rule(tool_call['tool_name'])
+                            console.out(result, highlight=False)
+                            console.rule()
+                        else:
+                            console.print(Panel(
+                                result, 
+                                title=f"[bold green]{tool_call['tool_name']}[/bold green]"
+                            ))
+                        
+                        # Actualizar historial
+                        self._update_history_with_tool_result(tool_call, result)
+                        
+                        action = _CONTROL_TOOLS.get(tool_call['tool_name'])
+                        
+                        # Verificar si la tarea está completa
+                        if action == 'finish':
+                            task_finished = True
+                            skipped = len(tool_calls) - index - 1
+                            if skipped:
+                                logger.info(
+                                    "finish_task recibido: se descartan %d resultados posteriores",
+                                    skipped
+                                )
+                            break
+                        
+                        # Verificar si se necesitan más pasos
+                        elif action == 'more_steps':
+                            steps_remaining += CONFIG.STEP_INCREMENT
+                            console.print(f"[yellow]Pasos aumentados a {steps_remaining}[/yellow]")
                     
-                    # Actualizar historial
-                    self._update_history_with_tool_result(tool_call, result)
-                    
-                    # Verificar si la tarea está completa
-                    if tool_call['tool_name'] == 'finish_task':
-                        console.print(Panel(
-                            "Tarea completada exitosamente", 
-                            title="[bold green]¡Éxito![/bold green]"
-                        ))
+                    if task_finished:
+                        logger.info(
+                            "Tarea %s completada en %.2fs",
+                            self.current_task.task_id,
+                            self.current_task.elapsed_seconds
+                        )
+                        self._banner("¡Éxito! Tarea completada exitosamente", _SUCCESS_STYLE)
                         self.current_task.reset()
                         return
-                    
-                    # Verificar si se necesitan más pasos
-                    elif tool_call['tool_name'] == 'request_more_steps':
-                        steps_remaining += CONFIG.STEP_INCREMENT
-                        console.print(f"[yellow]Pasos aumentados a {steps_remaining}[/yellow]")
                 
                 else:
                     # Respuesta de texto
@@ -804,76 +1743,97 @@ MEMORIA RELEVANTE:
             except GeminiQuotaExceededError:
                 logger.warning("Cuota de Gemini excedida, cambiando a Ollama")
                 self.model_manager.current_provider = ModelProvider.OLLAMA
+                query_func = self.model_manager.get_query_function()
+                model_name = self.model_manager.ollama_model
                 continue
                 
             except Exception as e:
-                logger.error(f"Error en turno: {e}")
+                logger.error("Error en turno: %s", e)
                 console.print(f"[red]Error en turno: {e}[/red]")
                 break
         
-        console.print(Panel(
-            "Se alcanzó el límite de pasos", 
-            title="[bold red]Límite alcanzado[/bold red]"
-        ))
+        self._banner("Límite alcanzado: se alcanzó el límite de pasos", _LIMIT_STYLE)
         self.current_task.reset()
     
-    def _parse_model_response(self, response):
-        """Parsea la respuesta del modelo buscando llamadas a herramientas de forma robusta."""
+    def _parse_model_response(self, response) -> List[Dict[str, Any]]:
+        """
+        Parsea la respuesta del modelo buscando llamadas a herramientas de forma robusta.
+        Devuelve la lista de llamadas encontradas (vacía si es una respuesta de texto).
+        """
         try:
             # Opción 1: Gemini con function calling nativo
-            if hasattr(response, 'candidates') and response.candidates:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    for part in candidate.content.parts:
-                        if hasattr(part, 'function_call'):
-                            tool_call = part.function_call
-                            parameters = dict(tool_call.args) if hasattr(tool_call.args, 'items') else {}
-                            return {
-                                'tool_name': tool_call.name,
-                                'parameters': parameters
-                            }
-
-            # Opción 2: Respuesta de texto con JSON (Ollama o Gemini fallback)
-            response_text = getattr(response, 'text', str(response))
-            
-            # Extraer contenido JSON de bloques de código
-            match = re.search(r"```json\n(.*?)\n```", response_text, re.DOTALL)
-            json_string = match.group(1) if match else response_text
-            
-            # Limpiar el string JSON antes de parsear
-            json_string = json_string.strip()
-            
-            # Si el string no parece un objeto JSON, no intentar parsear
-            if not json_string.startswith('{'):
-                return None
-
-            # Parsear el JSON
-            parsed_json = json.loads(json_string)
+            try:
+                parts = response.candidates[0].content.parts
+            except (AttributeError, IndexError):
+                parts = ()
+            
+            # Gemini puede emitir varias llamadas en paralelo en una misma respuesta
+            tool_calls = []
+            for part in parts:
+                # Un mensaje proto vacío es falso: las partes de texto no tienen llamada
+                tool_call = getattr(part, 'function_call', None)
+                if tool_call:
+                    tool_calls.append({
+                        'tool_name': tool_call.name,
+                        # Se pasa el mapeo del SDK sin copiar (solo lectura)
+                        'parameters': tool_call.args if tool_call.args is not None else {}
+                    })
+            if tool_calls:
+                return tool_calls
+
+            # Opción 2: JSON ya parseado por el adaptador (Ollama)
+            parsed_json = getattr(response, 'parsed', None)
+            
+            # Opción 3: Respuesta de texto con JSON (Gemini fallback)
+            if parsed_json is None:
+                response_text = getattr(response, 'text', str(response))
+                
+                # El objeto JSON está al principio o dentro de un bloque de código;
+                # se prefiere ```json y solo si no existe se usa el primer bloque genérico
+                start = _skip_whitespace(response_text, 0)
+                if not response_text.startswith('{', start):
+                    fence_start = response_text.find("```json")
+                    if fence_start != -1:
+                        content_start = fence_start + len("```json")
+                    else:
+                        fence_start = response_text.find("```")
+                        if fence_start == -1:
+                            return []
+                        content_start = fence_start + len("```")
+                    
+                    start = _skip_whitespace(response_text, content_start)
+                    if not response_text.startswith('{', start):
+                        return []
+                
+                json_string = _extract_json_object(response_text, start)
+                if json_string is None:
+                    return []
+                
+                # Parsear el JSON
+                parsed_json = _loads(json_string)
             
             # Validar la estructura del JSON
             if isinstance(parsed_json, dict) and 'tool_name' in parsed_json:
                 # Asegurarse de que 'parameters' sea un diccionario
                 if 'parameters' not in parsed_json or not isinstance(parsed_json['parameters'], dict):
                     parsed_json['parameters'] = {}
-                return parsed_json
+                return [parsed_json]
 
-        except (json.JSONDecodeError, TypeError) as e:
-            logger.debug(f"No se pudo parsear la respuesta como llamada a herramienta: {e}")
+        except (ValueError, TypeError) as e:
+            logger.debug("No se pudo parsear la respuesta como llamada a herramienta: %s", e)
         except Exception as e:
-            logger.error(f"Error inesperado al parsear la respuesta del modelo: {e}")
+            logger.error("Error inesperado al parsear la respuesta del modelo: %s", e)
 
-        return None
+        return []
     
     def _update_history_with_tool_result(self, tool_call: Dict, result: str):
-        """Actualiza el historial con el resultado de una herramienta"""
-        self.current_task.turn_history.append({
-            'role': 'model',
-            'parts': [f"Usando herramienta: {tool_call['tool_name']}"]
-        })
-        self.current_task.turn_history.append({
-            'role': 'user',
-            'parts': [f"Resultado: {result}"]
-        })
+        """
+        Añade al historial una única entrada con la llamada y su resultado.
+        El historial se reenvía en cada consulta, así que el resultado se recorta.
+        """
+        if len(result) > CONFIG.MAX_TOOL_RESULT_CHARS:
+            result = result[:CONFIG.MAX_TOOL_RESULT_CHARS] + "…"
+        self.current_task.add_turn(ROLE_USER, f"Tool {tool_call['tool_name']} -> {result}")
 
 # ============================================================================
 # FUNCIÓN PRINCIPAL
@@ -913,23 +1873,42 @@ def main():
             title="[bold green]Listo[/bold green]"
         ))
         
-        while True:
-            try:
-                user_input = Prompt.ask("\n[bold green]¿Qué deseas hacer?[/bold green]")
-                
-                if user_input.lower() in ['exit', 'quit']:
-                    console.print("[yellow]¡Hasta luego![/yellow]")
+        # Un único event loop para todas las tareas (los clientes asíncronos quedan ligados a él)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        
+        try:
+            # Entrada no interactiva (tubería o archivo): procesar todas las tareas por lotes
+            if not sys.stdin.isatty():
+                prompts = []
+                for line in sys.stdin:
+                    line = line.strip()
+                    if line.lower() in ['exit', 'quit']:
+                        break
+                    if line:
+                        prompts.append(line)
+                loop.run_until_complete(task_manager.execute_tasks(prompts))
+                return
+            
+            while True:
+                try:
+                    user_input = Prompt.ask("\n[bold green]¿Qué deseas hacer?[/bold green]")
+                    
+                    if user_input.lower() in ['exit', 'quit']:
+                        console.print("[yellow]¡Hasta luego![/yellow]")
+                        break
+                    
+                    if user_input.strip():
+                        loop.run_until_complete(task_manager.execute_task(user_input))
+                    
+                except KeyboardInterrupt:
+                    console.print("\n[yellow]¡Interrumpido! Saliendo...[/yellow]")
                     break
-                
-                if user_input.strip():
-                    task_manager.execute_task(user_input)
-                
-            except KeyboardInterrupt:
-                console.print("\n[yellow]¡Interrumpido! Saliendo...[/yellow]")
-                break
-            except Exception as e:
-                logger.error(f"Error en bucle principal: {e}")
-                console.print(f"[red]Error: {e}[/red]")
+                except Exception as e:
+                    logger.error(f"Error en bucle principal: {e}")
+                    console.print(f"[red]Error: {e}[/red]")
+        finally:
+            loop.close()
         
     except Exception as e:
         logger.error(f"Error crítico: {e}")